@@ -6,6 +6,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.finance import candlestick2_ochl
 from datetime import timedelta, datetime
+from feature_cache import FeatureCache, default_cache
+from execution import CostProfile, QuoteSpread, IdealPro, MIN_PRICE
 from strategies.bollinger1 import initialize, bollinger_bands_1
 
 # SET THE FOLLOWING CONFIGURATIONS BEFORE RUNNING THE MAIN SCRIPT
@@ -29,13 +31,18 @@ class BackTester(object):
     """
     Back Test intraday strategies (vectorized or event-driven)
     """
-    def __init__(self, data=None, commission=2E-5, start='20160101', end='20161001', strategy_params=None):
+    def __init__(self, data=None, commission=2E-5, start='20160101', end='20161001', strategy_params=None,
+                 feature_cache=None, execution=None):
         """
         set parameters and feed data
         :param data: pandas.DataFrame, bar data
         :param start: str, start date
         :param end: str, end date
         :param commission: commission fee
+        :param feature_cache: FeatureCache object, share indicators across runs and processes
+            (if None, use feature_cache.default_cache(), shared only by back testers of this process)
+        :param execution: CostProfile object, default execution cost model of both modes
+            (flat commission on bid/offer open in vector mode, fill at bid/offer close in event mode if None)
         """
         # pass back testing parameters
         data.rename(columns=COLUMNS_FX, inplace=True)
@@ -45,6 +52,10 @@ class BackTester(object):
         self.__data = data[(data.index >= start) & (data.index <= self.__end)]
         self.__strategy_params = {} if strategy_params is None else strategy_params
         self.__orders = None
+        self.__feature_cache = feature_cache
+        self.__execution = execution
+        self.__features = {}
+        self.__data_ids = {}
 
         # event-driven back tester live parameter
         self.__num = 0
@@ -64,36 +75,61 @@ class BackTester(object):
         self.sharpe = None
         self.max_dd = None
 
-    def run_vector(self, strategy):
+    def run_vector(self, strategy, execution=None):
         """
         run back testing in vectorization (mainly for signal trading strategy), save performance statistics
         :param strategy: function, must have argument 'data', return 'orders'
             (pandas.Series, index: datetime, value: zero for hold, positive number for buy, negative number for sell)
+        :param execution: CostProfile object, execution cost model (the one given to BackTester if None)
         :return: None
         """
-        # get orders and close position at EOD
+        # get orders (fill pass), reused by evaluate() for every cost profile
         self.__orders = strategy(data=self.__data, **self.__strategy_params)
         self.__orders = self.__orders.reindex(index=self.__data.index)
         self.__orders.fillna(0, inplace=True)
         self.__orders.name = 'ORDER'
-        self.__orders = pd.concat([self.__data['DATE'], self.__orders], axis=1)
-        daily_orders = self.__orders.groupby(by='DATE').sum()
+        self.evaluate(execution)
+
+    def evaluate(self, execution=None):
+        """
+        conclude trading result of the last run_vector() under a cost profile, save performance statistics
+        can be called repeatedly to compare cost profiles without running the strategy again
+        :param execution: CostProfile object, execution cost model (the one given to BackTester if None,
+            flat commission on bid/offer open if neither is set)
+        :return: dict, keys: 'pnl', 'sharpe', 'max_dd'
+        """
+        if self.__orders is None:
+            raise ValueError('no orders to evaluate, call run_vector() first.')
+        execution = self.__execution if execution is None else execution
+        # adjust order size and close position at EOD
+        orders = self.__orders
+        if execution is not None:
+            orders = pd.Series(execution.quantities(orders.values), index=orders.index, name='ORDER')
+        orders = pd.concat([self.__data['DATE'], orders], axis=1)
+        daily_orders = orders.groupby(by='DATE').sum()
         close_orders = -daily_orders
         close_orders.index += timedelta(hours=16)
-        close_orders = close_orders.reindex(index=self.__orders.index)
+        close_orders = close_orders.reindex(index=orders.index)
         close_orders.fillna(0, inplace=True)
-        self.__orders += close_orders
+        orders += close_orders
 
         # conclude trading result (daily P&L, Sharpe, trading frequency ...)
-        direction = np.sign(self.__orders['ORDER'])
-        cash_flow = (-0.5 * self.__data['BIDOPEN'] * (1 - direction * (1 - self.__commission))
-                     - 0.5 * self.__data['OFROPEN'] * (1 + direction * (1 + self.__commission))) * self.__orders['ORDER']
+        if execution is None:
+            direction = np.sign(orders['ORDER'])
+            cash_flow = (-0.5 * self.__data['BIDOPEN'] * (1 - direction * (1 - self.__commission))
+                         - 0.5 * self.__data['OFROPEN'] * (1 + direction * (1 + self.__commission))) * orders['ORDER']
+        else:
+            px = execution.prices(orders['ORDER'].values, self.__data['BIDOPEN'].values,
+                                  self.__data['OFROPEN'].values)
+            notional = px * orders['ORDER'].values
+            cash_flow = pd.Series(-notional - self.__commission * np.abs(notional), index=orders.index)
         cash_flow = pd.concat([cash_flow, self.__data['DATE']], axis=1)
         self.pnl = cash_flow.groupby(by='DATE').sum()
         self.curve = self.pnl.cumsum()
         self.sharpe = self.pnl.mean() / self.pnl.std() * np.sqrt(252)
         tracking_max = np.maximum.accumulate(self.curve)
         self.max_dd = ((tracking_max - self.curve) / tracking_max).max()
+        return {'pnl': self.pnl, 'sharpe': self.sharpe, 'max_dd': self.max_dd}
 
     def run_event(self, init, strategy):
         """
@@ -161,6 +197,27 @@ class BackTester(object):
         else:
             return self.__data[item].iloc[(self.__num - bars + 1): (self.__num + 1)]
 
+    def feature(self, indicator='SMA', item='CLOSE', **params):
+        """
+        retrieve indicator value of current bar, API function for event-driven back tester
+        indicators are computed once over the full data and cached on disk, see feature_cache.INDICATORS
+        :param indicator: str, indicator name, e.g. 'SMA', 'DIFF_STD'
+        :param item: str, column name the indicator is computed on
+        :param params: indicator parameters, e.g. window=20
+        :return: float
+        """
+        key = (indicator, item, tuple(sorted(params.items())))
+        values = self.__features.get(key)
+        if values is None:
+            if self.__feature_cache is None:
+                self.__feature_cache = default_cache()
+            if item not in self.__data_ids:
+                self.__data_ids[item] = FeatureCache.fingerprint(self.__data[item])
+            values = self.__feature_cache.get(self.__data[item], indicator, params=params,
+                                              data_id=self.__data_ids[item])
+            self.__features[key] = values
+        return values[self.__num]
+
     def order(self, quantity=1, order_type='MKT', price=None):
         """
         place order, API function for event-driven back tester
@@ -170,6 +227,12 @@ class BackTester(object):
         :return: None
         """
         if order_type == 'MKT':
+            if self.__execution is not None:
+                quantity, fill_px = self.__execution.fill(quantity, self.__data['BIDCLOSE'].iloc[self.__num],
+                                                          self.__data['OFRCLOSE'].iloc[self.__num])
+                if quantity == 0:
+                    return
+                price = fill_px if price is None else price
             self.position += quantity
             self.trades.iloc[self.__num] = 1
             if quantity > 0:
@@ -238,7 +301,9 @@ if __name__ == '__main__':
     fx_data['OfferOpen'] = fx_data['Close']
     fx_data['BidClose'] = fx_data['Close']
     fx_data['OfferClose'] = fx_data['Close']
-    back_tester = BackTester(data=fx_data, commission=0E-5, start='20150101', end='20150401')
+    # quotes are not recorded in this file, so spread is at least one tick
+    cost_profile = CostProfile([QuoteSpread(min_spread=MIN_PRICE['EUR']), IdealPro('EUR')])
+    back_tester = BackTester(data=fx_data, commission=0E-5, start='20150101', end='20150401', execution=cost_profile)
     back_tester.run_event(initialize, bollinger_bands_1)
     print back_tester.curve
     back_tester.curve.plot()
@@ -32,11 +32,10 @@ def bollinger_bands_1(context, window_len=20, entry_std=2, exit_std=0, margin=25
     :return:
     """
     # retrieve historical data
-    rolling_close = context.history(item='CLOSE', bars=window_len)
-    curr_close = rolling_close.iloc[-1]
+    curr_close = context.history(item='CLOSE', bars=1).iloc[-1]
     curr_pos = context.position
-    moving_avg = rolling_close.mean()
-    moving_std = rolling_close.diff(1).std()
+    moving_avg = context.feature(indicator='SMA', item='CLOSE', window=window_len)
+    moving_std = context.feature(indicator='DIFF_STD', item='CLOSE', window=window_len)
 
     # track indicators
     upper_entry = moving_avg + entry_std * moving_std   # price threshold
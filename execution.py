@@ -0,0 +1,133 @@
+__author__ = 'Mingda Ke'
+
+
+import numpy as np
+
+# minimum price variation for each currency (under paper trading environment)
+MIN_PRICE = {'EUR': 0.00005}
+
+# minimum order size for each currency on IDEALPRO, smaller orders are odd lots
+MIN_SIZE = {'EUR': 25000}
+
+
+class ExecutionModel(object):
+    """
+    execution model, transform order quantities and fill prices
+    all methods take numpy arrays (vector back tester) or scalars (event-driven back tester)
+    """
+    def quantity(self, quantity):
+        """
+        adjust order quantity
+        :param quantity: order quantity, positive for buy and negative for sell
+        :return: adjusted quantity, zero for orders not executed
+        """
+        return quantity
+
+    def price(self, quantity, price, bid, offer):
+        """
+        adjust fill price
+        :param quantity: order quantity, positive for buy and negative for sell
+        :param price: fill price from previous models (starts at mid price)
+        :param bid: bid price
+        :param offer: offer price
+        :return: adjusted fill price
+        """
+        return price
+
+
+class QuoteSpread(ExecutionModel):
+    """
+    cross the spread of recorded quotes: buy at offer, sell at bid
+    """
+    def __init__(self, min_spread=0.0):
+        """
+        :param min_spread: float, minimum spread, used when quotes are missing or bid equals offer
+        """
+        self.__min_spread = min_spread
+
+    def price(self, quantity, price, bid, offer):
+        spread = np.fmax(offer - bid, self.__min_spread)
+        return price + np.sign(quantity) * 0.5 * spread
+
+
+class SizeSlippage(ExecutionModel):
+    """
+    size-dependent slippage: price moves impact * (|quantity| / size) ** exponent against the order
+    """
+    def __init__(self, impact=1E-5, size=1000000, exponent=0.5):
+        """
+        :param impact: float, relative slippage of an order of reference size
+        :param size: int, reference order size
+        :param exponent: float, 0.5 for square-root impact, 1 for linear impact
+        """
+        self.__impact = impact
+        self.__size = float(size)
+        self.__exponent = exponent
+
+    def price(self, quantity, price, bid, offer):
+        slippage = self.__impact * (np.abs(quantity) / self.__size) ** self.__exponent
+        return price * (1 + np.sign(quantity) * slippage)
+
+
+class IdealPro(ExecutionModel):
+    """
+    IDEALPRO rules: drop orders below minimum size, round fill price to tick against the order
+    """
+    def __init__(self, currency='EUR'):
+        """
+        :param currency: str, fx pair, e.g. 'EUR'
+        """
+        self.__min_size = MIN_SIZE[currency]
+        self.__min_price = MIN_PRICE[currency]
+
+    def quantity(self, quantity):
+        return np.where(np.abs(quantity) < self.__min_size, 0, quantity)
+
+    def price(self, quantity, price, bid, offer):
+        ticks = price / self.__min_price
+        return np.where(quantity > 0, np.ceil(ticks - 1E-9), np.floor(ticks + 1E-9)) * self.__min_price
+
+
+class CostProfile(object):
+    """
+    chain of execution models, applied in order
+    """
+    def __init__(self, models=None):
+        """
+        :param models: list of ExecutionModel objects
+        """
+        self.models = [] if models is None else models
+
+    def quantities(self, quantity):
+        """
+        adjust order quantities, vectorized
+        :param quantity: numpy.ndarray, order quantities
+        :return: numpy.ndarray
+        """
+        for model in self.models:
+            quantity = model.quantity(quantity)
+        return quantity
+
+    def prices(self, quantity, bid, offer):
+        """
+        fill prices of orders, vectorized, starting from mid price
+        :param quantity: numpy.ndarray, order quantities (already adjusted)
+        :param bid: numpy.ndarray, bid prices
+        :param offer: numpy.ndarray, offer prices
+        :return: numpy.ndarray
+        """
+        price = 0.5 * (bid + offer)
+        for model in self.models:
+            price = model.price(quantity, price, bid, offer)
+        return price
+
+    def fill(self, quantity, bid, offer):
+        """
+        adjusted quantity and fill price of a single order
+        :param quantity: int or float, order quantity
+        :param bid: float, bid price
+        :param offer: float, offer price
+        :return: tuple (quantity, price), quantity keeps its type (zero for orders not executed)
+        """
+        quantity = self.quantities(quantity)
+        return np.asarray(quantity).item(), float(self.prices(quantity, bid, offer))
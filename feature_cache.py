@@ -0,0 +1,184 @@
+__author__ = 'Mingda Ke'
+
+
+import os
+import json
+import atexit
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# SET THE FOLLOWING CONFIGURATIONS BEFORE RUNNING THE MAIN SCRIPT
+
+# folder path where indicators are cached
+PATH_CACHE = '/Users/Mingda/Desktop/PropTrading/cache/'
+
+# disk budget of the cache folder in bytes
+BUDGET = 2 * 1024 ** 3
+
+
+def sma(series, window=20):
+    """
+    simple moving average over the last window bars (same as history(bars=window).mean())
+    :param series: pandas.Series, price series
+    :param window: int, number of bars
+    :return: pandas.Series
+    """
+    return series.rolling(window).mean()
+
+
+def diff_std(series, window=20):
+    """
+    standard deviation of bar-to-bar changes over the last window bars
+    (same as history(bars=window).diff(1).std())
+    :param series: pandas.Series, price series
+    :param window: int, number of bars
+    :return: pandas.Series
+    """
+    return series.diff(1).rolling(window - 1).std()
+
+
+# key: indicator name, value: function(series, **params), vectorized over the full dataset
+INDICATORS = {'SMA': sma,
+              'DIFF_STD': diff_std}
+
+# cache shared by all back testers of this process that are not given one, see default_cache()
+_default_cache = None
+
+
+def default_cache():
+    """
+    return the cache shared within this process, in a temporary folder deleted at exit
+    pass a FeatureCache on a fixed folder to share indicators across processes or sessions
+    :return: FeatureCache object
+    """
+    global _default_cache
+    if _default_cache is None:
+        path = tempfile.mkdtemp(prefix='feature_cache_')
+        atexit.register(shutil.rmtree, path, True)
+        _default_cache = FeatureCache(path)
+    return _default_cache
+
+
+class FeatureCache(object):
+    """
+    disk cache of vectorized indicators, shared across back testing runs
+    """
+    def __init__(self, path=PATH_CACHE, budget=BUDGET):
+        """
+        set cache folder and disk budget
+        :param path: str, folder path where indicators are saved
+        :param budget: int, maximum bytes on disk, least recently used files are evicted above it
+        """
+        self.__path = path
+        self.__budget = budget
+        self.__arrays = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def fingerprint(series):
+        """
+        hash index and values of a series, so that the same data gives the same key across runs
+        :param series: pandas.Series
+        :return: str, hex digest
+        """
+        md5 = hashlib.md5()
+        md5.update(np.ascontiguousarray(series.index.values.astype('int64')).tobytes())
+        md5.update(np.ascontiguousarray(series.values.astype('float64')).tobytes())
+        return md5.hexdigest()
+
+    def get(self, series, indicator, params=None, data_id=None):
+        """
+        return indicator values for every bar, computed once and memory-mapped from disk afterwards
+        :param series: pandas.Series, input data
+        :param indicator: str, indicator name in INDICATORS
+        :param params: dict, indicator parameters
+        :param data_id: str, fingerprint of series if already known, avoid hashing the data again
+        :return: numpy.ndarray (read-only memmap), aligned with series
+        """
+        if indicator not in INDICATORS:
+            raise ValueError(indicator + ' is not a valid indicator.')
+        params = {} if params is None else params
+        data_id = FeatureCache.fingerprint(series) if data_id is None else data_id
+        md5 = hashlib.md5()
+        md5.update(data_id.encode('ascii'))
+        md5.update(json.dumps([indicator, sorted(params.items())]).encode('ascii'))
+        name = md5.hexdigest() + '.npy'
+        file_path = os.path.join(self.__path, name)
+        values = self.__arrays.get(name)
+        if values is not None:
+            self.touch(file_path)
+            return values
+
+        if os.path.exists(file_path):
+            self.touch(file_path)
+            try:
+                values = np.load(file_path, mmap_mode='r')
+            except (IOError, OSError):  # evicted by another process since exists(), compute again
+                values = None
+        if values is None:
+            # unique temp file per writer, so processes computing the same indicator don't clash
+            result = np.asarray(INDICATORS[indicator](series, **params), dtype='float64')
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.__path)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, result)
+            os.rename(tmp_path, file_path)
+            self.evict(keep=name)
+            try:
+                values = np.load(file_path, mmap_mode='r')
+            except (IOError, OSError):  # evicted by another process right after writing
+                values = result
+        self.__arrays[name] = values
+        return values
+
+    @staticmethod
+    def touch(file_path):
+        """
+        mark a cached file as recently used, ignore files already evicted by another process
+        :param file_path: str
+        :return: None
+        """
+        try:
+            os.utime(file_path, None)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """
+        delete least recently used files until the cache folder fits in the disk budget
+        :param keep: str, file name never to evict (the one just written)
+        :return: None
+        """
+        files = []
+        for name in os.listdir(self.__path):
+            if not name.endswith('.npy'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.__path, name))
+            except OSError:     # evicted by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(f[1] for f in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.__budget:
+                break
+            if name == keep:
+                continue
+            self.__arrays.pop(name, None)
+            try:
+                os.remove(os.path.join(self.__path, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        delete all cached indicators
+        :return: None
+        """
+        self.__arrays = {}
+        for name in os.listdir(self.__path):
+            if name.endswith('.npy'):
+                os.remove(os.path.join(self.__path, name))
@@ -9,9 +9,7 @@ import pandas as pd
 from datetime import datetime, timedelta
 
 from market_making import market_making
-
-# minimum price variation for each currency (under paper trading environment)
-MIN_PRICE = {'EUR': 0.00005}
+from execution import MIN_PRICE
 
 
 class FXTrader(object):
@@ -3,6 +3,9 @@ __author__ = 'Mingda'
 
 from ib.opt import Connection
 from ib.ext.Contract import Contract
+import os
+import calendar
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from time import sleep
@@ -26,12 +29,140 @@ LIMITS = {
     '1 day': '1 Y'
 }
 
+# (column name, dtype) of bar buffers
+COLUMNS = [('DATETIME', 'int64'),   # seconds since epoch, TWS local time
+           ('OPEN', 'float64'),
+           ('HIGH', 'float64'),
+           ('LOW', 'float64'),
+           ('CLOSE', 'float64'),
+           ('VWAP', 'float64'),
+           ('VOLUME', 'int64'),
+           ('NUMTRADE', 'int64')]
+
+
+class BarBuffer(object):
+    """
+    growable typed column buffers for bar data, full chunks are flushed to a bar store
+    """
+    def __init__(self, chunk_size=100000, store=None):
+        """
+        initialize function, allocate buffers
+        :param chunk_size: int, number of bars kept in memory before flushing a chunk
+        :param store: str, folder path where chunks are saved (.npz), keep compact chunks in memory if None
+        """
+        self.__chunk_size = chunk_size
+        self.__store = store
+        self.__capacity = 1024
+        self.__columns = dict((name, np.empty(self.__capacity, dtype=dtype)) for name, dtype in COLUMNS)
+        self.__chunks = []     # file paths (store) or dicts of arrays (in memory)
+        self.size = 0           # bars in current buffer
+        self.total = 0          # bars appended in all
+        self.earliest = None    # earliest DATETIME appended, seconds since epoch
+        self.floor = None       # bars at or after floor are already stored (overlap of consecutive requests)
+        if store is not None and not os.path.isdir(store):
+            os.makedirs(store)
+
+    def append(self, tm, open_px, high, low, close, vwap, volume, count):
+        """
+        append one bar, double buffer size when full and flush once a chunk is complete
+        :return: None
+        """
+        if self.floor is not None and tm >= self.floor:
+            return
+        if self.size == self.__capacity:
+            self.__capacity *= 2
+            for name, dtype in COLUMNS:
+                column = np.empty(self.__capacity, dtype=dtype)
+                column[:self.size] = self.__columns[name][:self.size]
+                self.__columns[name] = column
+        i = self.size
+        self.__columns['DATETIME'][i] = tm
+        self.__columns['OPEN'][i] = open_px
+        self.__columns['HIGH'][i] = high
+        self.__columns['LOW'][i] = low
+        self.__columns['CLOSE'][i] = close
+        self.__columns['VWAP'][i] = vwap
+        self.__columns['VOLUME'][i] = volume
+        self.__columns['NUMTRADE'][i] = count
+        self.size += 1
+        self.total += 1
+        if self.earliest is None or tm < self.earliest:
+            self.earliest = tm
+        if self.size >= self.__chunk_size:
+            self.flush()
+
+    def flush(self, force=False):
+        """
+        move buffered bars to the bar store once a chunk is full
+        :param force: bool, flush even if the chunk is not full
+        :return: None
+        """
+        if self.size == 0 or (self.size < self.__chunk_size and not force):
+            return
+        chunk = dict((name, self.__columns[name][:self.size].copy()) for name, _ in COLUMNS)
+        if self.__store is None:
+            self.__chunks.append(chunk)
+        else:
+            file_path = os.path.join(self.__store, 'chunk_{:06d}.npz'.format(len(self.__chunks)))
+            np.savez(file_path, **chunk)
+            self.__chunks.append(file_path)
+        self.size = 0
+
+    def chunks(self):
+        """
+        iterate over all chunks in order, one chunk in memory at a time
+        :return: generator of dict, key: column name, value: numpy.ndarray
+        """
+        self.flush(force=True)
+        for chunk in self.__chunks:
+            if self.__store is None:
+                yield chunk
+            else:
+                with np.load(chunk) as z:
+                    yield dict((name, z[name]) for name, _ in COLUMNS)
+
+    @staticmethod
+    def chunk_frame(chunk):
+        """
+        convert a chunk to a data frame
+        :param chunk: dict, key: column name, value: numpy.ndarray
+        :return: pandas.DataFrame, index: DATETIME
+        """
+        data = pd.DataFrame(chunk, columns=[name for name, _ in COLUMNS])
+        data['DATETIME'] = pd.to_datetime(data['DATETIME'], unit='s')
+        data.set_index(keys='DATETIME', inplace=True)
+        return data
+
+    def to_frame(self):
+        """
+        concatenate all chunks into a data frame, needs memory for the whole dataset
+        :return: pandas.DataFrame, index: DATETIME
+        """
+        frames = [BarBuffer.chunk_frame(chunk) for chunk in self.chunks()]
+        if len(frames) == 0:
+            return BarBuffer.chunk_frame(dict((name, np.empty(0, dtype=dtype)) for name, dtype in COLUMNS))
+        return pd.concat(frames)
+
+    def to_csv(self, file_path):
+        """
+        write all chunks to a csv file chunk by chunk, memory is bounded by chunk size
+        :param file_path: str, csv file path
+        :return: None
+        """
+        header = True
+        for chunk in self.chunks():
+            BarBuffer.chunk_frame(chunk).to_csv(file_path, mode='w' if header else 'a', header=header)
+            header = False
+        if header:
+            self.to_frame().to_csv(file_path)
+
 
 class Loader(object):
     """
     data loader class, download data from IB (Interactive Broker) API
     """
-    def __init__(self, symbol, exch, start, end, sec_type='STK', expiration=None, bar_size='5 secs', manual=False):
+    def __init__(self, symbol, exch, start, end, sec_type='STK', expiration=None, bar_size='5 secs', manual=False,
+                 chunk_size=100000, store=None, port=PORT, client_id=ID):
         """
         initialize function, set parameters
         :param symbol: contract symbol
@@ -42,9 +173,15 @@ class Loader(object):
         :param start: start date, YYYYMMDD
         :param end: end date, YYYYMMDD
         :param manual: manually change port, request() return result after 60 request.
+        :param chunk_size: int, number of bars kept in memory before flushing to the bar store
+        :param store: str, folder path of the bar store, keep chunks in memory if None
+            with a store, request() keeps bars on disk and save() streams them to csv;
+            without one, request() builds self.data and memory holds the whole dataset
+        :param port: int, TWS/gateway port
+        :param client_id: int, API client ID
         :return: None
         """
-        self.__conn = Connection.create(port=PORT, clientId=ID)
+        self.__conn = Connection.create(port=port, clientId=client_id)
         self.__conn.connect()
         self.__conn.register(Loader.error_handler, 'Error')
         self.__conn.register(self.msg_parser, 'HistoricalData')
@@ -61,8 +198,25 @@ class Loader(object):
 
         self.__req_id = 0
         self.__finish = False
-        self.data = []  # appending to list is faster than DataFrame
-        self.datetimes = []
+        self.__store = store
+        self.__bars = BarBuffer(chunk_size=chunk_size, store=store)
+        self.data = None
+
+    @property
+    def num_requests(self):
+        """
+        number of historical data requests sent
+        :return: int
+        """
+        return self.__req_id
+
+    @property
+    def num_bars(self):
+        """
+        number of bars received
+        :return: int
+        """
+        return self.__bars.total
 
     @staticmethod
     def make_contract(symbol, expiration, sec_type, prime_exchange, curr):
@@ -112,28 +266,38 @@ class Loader(object):
         """
         print "Server Error: %s" % msg
 
+    @staticmethod
+    def parse_date(date):
+        """
+        parse IB bar date ('YYYYMMDD  HH:MM:SS' or 'YYYYMMDD') to seconds since epoch, without timezone conversion
+        :param date: str, bar date
+        :return: int
+        """
+        if len(date) == 8:
+            return calendar.timegm((int(date[:4]), int(date[4:6]), int(date[6:8]), 0, 0, 0))
+        return calendar.timegm((int(date[:4]), int(date[4:6]), int(date[6:8]),
+                                int(date[-8:-6]), int(date[-5:-3]), int(date[-2:])))
+
     def msg_parser(self, msg):
         if msg.open != -1:
-            new_data = {'DATETIME': pd.Timestamp(msg.date), 'OPEN': msg.open, 'HIGH': msg.high,
-                        'LOW': msg.low, 'CLOSE': msg.close, 'VWAP': msg.WAP, 'VOLUME': msg.volume,
-                        'NUMTRADE': msg.count}
-            self.data.append(new_data)
-            self.datetimes.append(new_data['DATETIME'])
+            self.__bars.append(Loader.parse_date(msg.date), msg.open, msg.high, msg.low, msg.close, msg.WAP,
+                               msg.volume, msg.count)
         else:
             print 'finish!'
             self.__finish = True
 
     def request(self, item='TRADES'):
         """
-        request historical data and save in self.__data
+        request historical data and save in self.data (only without a bar store, use save() otherwise)
         :param item: str, 'TRADES', 'BID', 'ASK'
         :return: None
         """
         count = 0
         tm = self.__end_time
         while tm > self.__start_time:
-            print "Timestamp:{} Data Length: {}".format(tm, len(self.data))
+            print "Timestamp:{} Data Length: {}".format(tm, self.__bars.total)
             self.__finish = False
+            self.__bars.floor = self.__bars.earliest
             # setting useRTH=0 will automatically neglect market closed time.
             self.__conn.reqHistoricalData(tickerId=self.__req_id, contract=self.__contract
                                           , endDateTime=tm.strftime('%Y%m%d %H:%M:%S EST'), durationStr=self.__duration
@@ -150,19 +314,27 @@ class Loader(object):
 
             while not self.__finish:    # wait callback function to finish appending.
                 pass
-            tm = min(self.datetimes)
+            if self.__bars.earliest is None:
+                break
+            tm = datetime(1970, 1, 1) + timedelta(seconds=self.__bars.earliest)
 
         # convert data to data frame format.
-        self.data = pd.DataFrame(self.data)
-        self.data.drop_duplicates(inplace=True)
-        if len(self.data) > 0:
-            self.data.set_index(keys='DATETIME', inplace=True)
+        if self.__store is None:
+            self.data = self.__bars.to_frame()
         self.__conn.disconnect()
 
+    def save(self, file_path):
+        """
+        write downloaded bars to csv chunk by chunk
+        :param file_path: str, csv file path
+        :return: None
+        """
+        self.__bars.to_csv(file_path)
+
 
 if __name__ == "__main__":
     loader = Loader(symbol='EUR', sec_type='CASH', exch='IDEALPRO', start='20161001', end='20161020',
-                    bar_size='1 min', manual=False)
+                    bar_size='1 min', manual=False, store=EXPORT_PATH + 'EURUSD_bid_bars/')
     print 'request'
     loader.request('BID')
-    loader.data.to_excel(EXPORT_PATH + 'EURUSD_ask.xlsx')
+    loader.save(EXPORT_PATH + 'EURUSD_bid.csv')
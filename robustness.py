@@ -0,0 +1,154 @@
+__author__ = 'Mingda Ke'
+
+
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+
+# statistics of each path, columns of stats array
+STATS = ['SHARPE', 'MAX_DD', 'RECOVERY']
+
+# quantiles in summary
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+def block_bootstrap(pnl, n_paths, block, rng):
+    """
+    resample pnl by blocks of consecutive bars (with replacement), keep short-term autocorrelation
+    :param pnl: numpy.ndarray, P&L of each period
+    :param n_paths: int, number of paths
+    :param block: int, block length
+    :param rng: numpy.random.RandomState
+    :return: numpy.ndarray, shape (n_paths, len(pnl))
+    """
+    n = len(pnl)
+    block = min(block, n)
+    n_blocks = -(-n // block)
+    starts = rng.randint(0, n - block + 1, size=(n_paths, n_blocks))
+    idx = (starts[:, :, np.newaxis] + np.arange(block)).reshape(n_paths, -1)[:, :n]
+    return pnl[idx]
+
+
+def trade_shuffle(pnl, n_paths, rng):
+    """
+    shuffle order of trades (without replacement), Sharpe is unchanged but drawdown and recovery vary
+    :param pnl: numpy.ndarray, P&L of each trade
+    :param n_paths: int, number of paths
+    :param rng: numpy.random.RandomState
+    :return: numpy.ndarray, shape (n_paths, len(pnl))
+    """
+    idx = np.argsort(rng.rand(n_paths, len(pnl)), axis=1)
+    return pnl[idx]
+
+
+def path_stats(paths, capital, periods):
+    """
+    Sharpe, maximum drawdown and time to recovery of each path, vectorized over paths
+    :param paths: numpy.ndarray, shape (n_paths, n), P&L of each period
+    :param capital: float, initial capital, drawdown is relative to capital plus cumulative P&L
+    :param periods: int, periods per year to annualize Sharpe
+    :return: numpy.ndarray, shape (n_paths, 3), columns in STATS, Sharpe is NaN for zero-variance paths
+    """
+    std = paths.std(axis=1, ddof=1)
+    sharpe = paths.mean(axis=1) / np.where(std > 0, std, np.nan) * np.sqrt(periods)
+    # initial capital is the first peak
+    curve = np.column_stack([np.full(len(paths), capital, dtype='float64'), capital + np.cumsum(paths, axis=1)])
+    tracking_max = np.maximum.accumulate(curve, axis=1)
+    max_dd = ((tracking_max - curve) / tracking_max).max(axis=1)
+    # time to recovery: longest number of periods spent below the previous peak (unrecovered ones included)
+    bars = np.arange(curve.shape[1])
+    last_peak = np.maximum.accumulate(np.where(curve >= tracking_max, bars, -1), axis=1)
+    recovery = (bars - last_peak).max(axis=1)
+    return np.column_stack([sharpe, max_dd, recovery])
+
+
+def run_batch(args):
+    """
+    generate one batch of paths and return their statistics, executed in worker processes
+    :param args: tuple (pnl, method, block, n_paths, seed, capital, periods)
+    :return: numpy.ndarray, shape (n_paths, 3)
+    """
+    pnl, method, block, n_paths, seed, capital, periods = args
+    rng = np.random.RandomState(seed)
+    if method == 'block':
+        paths = block_bootstrap(pnl, n_paths, block, rng)
+    elif method == 'shuffle':
+        paths = trade_shuffle(pnl, n_paths, rng)
+    else:
+        raise ValueError(method + ' is not a valid parameter.')
+    return path_stats(paths, capital, periods)
+
+
+class Resampler(object):
+    """
+    Monte Carlo robustness test of back testing results (block bootstrap or trade shuffle)
+    """
+    def __init__(self, pnl, method='block', block=20, capital=1000000.0, periods=252):
+        """
+        set parameters and feed P&L
+        :param pnl: pandas.Series/DataFrame or numpy.ndarray, daily P&L (BackTester.pnl) or P&L of each trade
+        :param method: str, 'block' (block bootstrap) or 'shuffle' (trade shuffle)
+        :param block: int, block length in periods, only for 'block'
+        :param capital: float, initial capital, drawdown is relative to capital plus cumulative P&L
+        :param periods: int, periods per year to annualize Sharpe
+        """
+        if method not in ('block', 'shuffle'):
+            raise ValueError(method + ' is not a valid parameter.')
+        self.__pnl = np.asarray(pnl, dtype='float64').ravel()
+        self.__pnl = self.__pnl[~np.isnan(self.__pnl)]
+        if len(self.__pnl) < 2:
+            raise ValueError('pnl needs at least 2 observations, got {}.'.format(len(self.__pnl)))
+        self.__method = method
+        self.__block = block
+        self.__capital = capital
+        self.__periods = periods
+
+        # resampling result
+        self.stats = None
+        self.summary = None
+
+    def run(self, n_paths=10000, batch=1000, processes=None, seed=0, path=None):
+        """
+        generate paths in batches on a process pool, save statistics of every path and summary quantiles
+        results only depend on seed and batch, not on the number of processes
+        :param n_paths: int, number of paths
+        :param batch: int, paths per batch, bounds memory of each worker to batch * len(pnl)
+        :param processes: int, number of worker processes (number of CPUs if None, 1 runs in this process)
+        :param seed: int, random seed
+        :param path: str, folder path, stats.csv is appended batch by batch and summary.csv written at the end
+        :return: pandas.DataFrame, summary quantiles, index: QUANTILES, columns: STATS
+        """
+        n_batches = -(-n_paths // batch)
+        seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=n_batches)
+        tasks = [(self.__pnl, self.__method, self.__block, min(batch, n_paths - i * batch), seeds[i],
+                  self.__capital, self.__periods) for i in range(n_batches)]
+
+        stats_file = None
+        if path is not None:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            stats_file = open(os.path.join(path, 'stats.csv'), 'w')
+            stats_file.write(','.join(STATS) + '\n')
+
+        pool = Pool(processes) if processes != 1 else None
+        try:
+            results = pool.imap(run_batch, tasks) if pool is not None else (run_batch(task) for task in tasks)
+            stats = []
+            for result in results:
+                stats.append(result)
+                if stats_file is not None:
+                    np.savetxt(stats_file, result, delimiter=',')
+                    stats_file.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if stats_file is not None:
+                stats_file.close()
+
+        self.stats = pd.DataFrame(np.concatenate(stats), columns=STATS)
+        self.summary = self.stats.quantile(QUANTILES)
+        if path is not None:
+            self.summary.to_csv(os.path.join(path, 'summary.csv'))
+        return self.summary
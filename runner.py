@@ -0,0 +1,464 @@
+__author__ = 'Mingda Ke'
+
+
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import argparse
+import itertools
+import importlib
+import resource
+import threading
+import traceback
+import pandas as pd
+from multiprocessing import Process
+
+# SET THE FOLLOWING CONFIGURATIONS BEFORE RUNNING THE MAIN SCRIPT
+
+# folder path where jobs (spec, state, log, results) are saved, relative to working directory by default
+PATH_JOBS = os.environ.get('IBALGO_JOBS', 'jobs')
+
+# API client ID of the first download job without 'client_id', next jobs count up, so that concurrent
+# downloads don't share a connection ID (loader.ID is left for manual runs)
+CLIENT_ID = 2000
+
+# default per-job limits, can be overridden by 'cpu' (seconds) and 'memory' (MB) in job spec
+CPU_LIMIT = None
+MEMORY_LIMIT = None
+
+# seconds between progress updates of running downloads
+PROGRESS_INTERVAL = 10
+
+JOB_TYPES = ('backtest', 'sweep', 'download')
+
+
+def load_spec(file_path):
+    """
+    read job specs from JSON or YAML file
+    :param file_path: str, path of spec file, contains one job (dict) or several jobs (list)
+    :return: list of dict
+    """
+    with open(file_path) as f:
+        if file_path.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is required to read ' + file_path)
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    specs = specs if isinstance(specs, list) else [specs]
+    for spec in specs:
+        if spec.get('type') not in JOB_TYPES:
+            raise ValueError(str(spec.get('type')) + ' is not a valid job type.')
+    return specs
+
+
+def load_csv(file_path):
+    """
+    read bar data for BackTester, sorted by time without duplicate bars,
+    missing bid/offer columns are filled with close price
+    :param file_path: str, csv file with 'Date' and 'Timestamp' columns, or DATETIME index (saved by Loader)
+    :return: pandas.DataFrame
+    """
+    data = pd.read_csv(file_path)
+    if 'Date' in data.columns and 'Timestamp' in data.columns:
+        data.index = pd.to_datetime(data['Date'].astype('str') + ' ' + data['Timestamp'])
+    else:
+        data.index = pd.to_datetime(data.iloc[:, 0])
+        data = data.iloc[:, 1:]
+    for column in ['BidOpen', 'OfferOpen', 'BidClose', 'OfferClose']:
+        if column not in data.columns:
+            data[column] = data['Close'] if 'Close' in data.columns else data['CLOSE']
+    # Loader writes requests newest first, back testing needs bars in time order
+    data = data[~data.index.duplicated(keep='first')]
+    data.sort_index(inplace=True)
+    if 'DATE' not in data.columns:
+        data['DATE'] = data.index.normalize()
+    return data
+
+
+def import_function(name):
+    """
+    import function by dotted name, e.g. 'bollinger1.bollinger_bands_1'
+    :param name: str
+    :return: function
+    """
+    module, function = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module), function)
+
+
+class JobQueue(object):
+    """
+    local job queue, one folder per job with spec.json, state.json, log.txt and results
+    """
+    def __init__(self, path=PATH_JOBS):
+        """
+        :param path: str, folder path where jobs are saved
+        """
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def job_ids(self):
+        """
+        :return: list of job IDs, in submission order
+        """
+        return sorted(name for name in os.listdir(self.path)
+                      if os.path.exists(os.path.join(self.path, name, 'spec.json')))
+
+    def submit(self, spec):
+        """
+        add a job to the queue
+        :param spec: dict, job spec
+        :return: str, job ID
+        """
+        job_id = time.strftime('%Y%m%d-%H%M%S')
+        count = 0
+        while os.path.exists(os.path.join(self.path, '{}-{:03d}'.format(job_id, count))):
+            count += 1
+        job_id = '{}-{:03d}'.format(job_id, count)
+        os.makedirs(os.path.join(self.path, job_id))
+        with open(os.path.join(self.path, job_id, 'spec.json'), 'w') as f:
+            json.dump(spec, f, indent=2)
+        self.update(job_id, type=spec['type'], status='queued', submitted=time.time(), started=None,
+                    finished=None, bars=0, requests=0, error=None)
+        return job_id
+
+    def spec(self, job_id):
+        """
+        :param job_id: str
+        :return: dict, job spec
+        """
+        with open(os.path.join(self.path, job_id, 'spec.json')) as f:
+            return json.load(f)
+
+    def state(self, job_id):
+        """
+        :param job_id: str
+        :return: dict, job state (status, submitted, started, finished, bars, requests, error, pid)
+        """
+        with open(os.path.join(self.path, job_id, 'state.json')) as f:
+            return json.load(f)
+
+    def update(self, job_id, **fields):
+        """
+        update job state, written atomically so that status readers never see a partial file
+        :param job_id: str
+        :param fields: state fields to update
+        :return: None
+        """
+        file_path = os.path.join(self.path, job_id, 'state.json')
+        state = self.state(job_id) if os.path.exists(file_path) else {}
+        state.update(fields)
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=2)
+        os.rename(file_path + '.tmp', file_path)
+
+    def client_id(self, job_id):
+        """
+        API client ID of a download job, 'client_id' in spec or CLIENT_ID plus job index
+        :param job_id: str
+        :return: int
+        """
+        return self.spec(job_id).get('client_id', CLIENT_ID + self.job_ids().index(job_id))
+
+    @staticmethod
+    def pid_alive(pid):
+        """
+        :param pid: int or None, process ID
+        :return: bool, whether the process still exists
+        """
+        if pid is None:
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
+
+    def resume(self):
+        """
+        put jobs left running by a previous runner back to the queue, unless their worker process is still alive
+        :return: list of job IDs resumed
+        """
+        job_ids = [job_id for job_id in self.job_ids() if self.state(job_id)['status'] == 'running'
+                   and not JobQueue.pid_alive(self.state(job_id).get('pid'))]
+        for job_id in job_ids:
+            self.update(job_id, status='queued', pid=None)
+        return job_ids
+
+    def run(self, workers=1):
+        """
+        run queued jobs on a pool of worker processes until the queue is empty
+        only one runner works on a queue folder: runner.lock is locked until the runner and its workers exit
+        :param workers: int, maximum number of jobs running at the same time
+        :return: None
+        """
+        lock = open(os.path.join(self.path, 'runner.lock'), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lock.close()
+            raise RuntimeError('another runner is working on ' + self.path)
+        try:
+            self.__run(workers)
+        finally:
+            lock.close()
+
+    def __run(self, workers):
+        """
+        job loop of run(), called with the queue lock held
+        :param workers: int, maximum number of jobs running at the same time
+        :return: None
+        """
+        self.resume()
+        running = {}
+        while True:
+            for job_id, process in list(running.items()):
+                if not process.is_alive():
+                    process.join()
+                    if self.state(job_id)['status'] == 'running':    # killed, e.g. by CPU/memory limit
+                        self.update(job_id, status='failed', finished=time.time(), pid=None,
+                                    error='exit code {}'.format(process.exitcode))
+                    del running[job_id]
+            queued = [job_id for job_id in self.job_ids()
+                      if job_id not in running and self.state(job_id)['status'] == 'queued']
+            if len(queued) == 0 and len(running) == 0:
+                break
+            # a download waits while another running download uses the same client ID
+            client_ids = set(self.client_id(job_id) for job_id in running
+                             if self.state(job_id)['type'] == 'download')
+            started = []
+            for job_id in queued:
+                if len(running) + len(started) >= workers:
+                    break
+                if self.state(job_id)['type'] == 'download':
+                    if self.client_id(job_id) in client_ids:
+                        continue
+                    client_ids.add(self.client_id(job_id))
+                started.append(job_id)
+            for job_id in started:
+                self.update(job_id, status='running', started=time.time(), finished=None, bars=0, requests=0,
+                            error=None)
+                process = Process(target=run_job, args=(self.path, job_id))
+                process.start()
+                self.update(job_id, pid=process.pid)
+                running[job_id] = process
+            time.sleep(1)
+
+    def status(self):
+        """
+        status of all jobs with throughput
+        :return: pandas.DataFrame, index: job ID
+        """
+        rows = []
+        now = time.time()
+        for job_id in self.job_ids():
+            state = self.state(job_id)
+            elapsed = None
+            if state['started'] is not None:
+                elapsed = (state['finished'] or now) - state['started']
+            rows.append({'JOB': job_id, 'TYPE': state['type'], 'STATUS': state['status'],
+                         'ELAPSED': elapsed, 'BARS': state['bars'],
+                         'BARS/SEC': state['bars'] / elapsed if elapsed else None,
+                         'REQUESTS': state['requests'],
+                         'REQUESTS/MIN': state['requests'] / elapsed * 60 if elapsed else None})
+        columns = ['JOB', 'TYPE', 'STATUS', 'ELAPSED', 'BARS', 'BARS/SEC', 'REQUESTS', 'REQUESTS/MIN']
+        return pd.DataFrame(rows, columns=columns).set_index('JOB')
+
+
+def run_job(path, job_id):
+    """
+    run one job in a worker process: set limits, redirect output to log.txt, save results in job folder
+    :param path: str, folder path of job queue
+    :param job_id: str
+    :return: None
+    """
+    queue = JobQueue(path)
+    spec = queue.spec(job_id)
+    job_path = os.path.join(path, job_id)
+
+    cpu = spec.get('cpu', CPU_LIMIT)
+    memory = spec.get('memory', MEMORY_LIMIT)
+    if cpu is not None:
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu), int(cpu)))
+    if memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (int(memory) * 1024 ** 2, int(memory) * 1024 ** 2))
+
+    log = open(os.path.join(job_path, 'log.txt'), 'a')
+    sys.stdout = sys.stderr = log
+    try:
+        if spec['type'] == 'download':
+            run_download(queue, job_id, spec, job_path)
+        else:
+            run_backtest(queue, job_id, spec, job_path)
+        queue.update(job_id, status='done', finished=time.time())
+    except BaseException:
+        traceback.print_exc()
+        queue.update(job_id, status='failed', finished=time.time(), error=traceback.format_exc().splitlines()[-1])
+    finally:
+        log.close()
+
+
+def make_profile(models):
+    """
+    build a cost profile from a job spec, e.g. [{"model": "QuoteSpread", "min_spread": 1E-4}, {"model": "IdealPro"}]
+    :param models: list of dict, 'model' is a class name in execution, other keys are its parameters
+    :return: CostProfile object, None if models is None
+    """
+    import execution
+    if models is None:
+        return None
+    models = [dict(model) for model in models]
+    return execution.CostProfile([getattr(execution, model.pop('model'))(**model) for model in models])
+
+
+def stats(back_tester):
+    """
+    :param back_tester: BackTester object after a run
+    :return: tuple (sharpe, max_dd) as floats (vector mode keeps them in single-column series)
+    """
+    return float(pd.Series(back_tester.sharpe).iloc[0]), float(pd.Series(back_tester.max_dd).iloc[0])
+
+
+def run_backtest(queue, job_id, spec, job_path):
+    """
+    run a back test, or a sweep over the product of 'grid' parameters and 'profiles', sharing one feature cache
+    job spec keys: data, strategy, init (event-driven, vector mode if missing), start, end, commission,
+    params, execution (cost profile, see make_profile), grid (sweep only),
+    profiles (sweep only, dict of name: cost profile; in vector mode every profile reuses one strategy run),
+    cache (folder path of feature cache, 'cache' in job queue folder by default)
+    results: result.json, curve.csv and pnl.csv (backtest), sweep.csv appended run by run (sweep)
+    :return: None
+    """
+    from backtester import BackTester
+    from feature_cache import FeatureCache
+
+    data = load_csv(spec['data'])
+    strategy = import_function(spec['strategy'])
+    init = import_function(spec['init']) if spec.get('init') else None
+    cache = FeatureCache(spec.get('cache') or os.path.join(queue.path, 'cache'))
+    default_profile = make_profile(spec.get('execution'))
+    grid = spec.get('grid', {}) if spec['type'] == 'sweep' else {}
+    names = sorted(grid.keys())
+    profiles = spec.get('profiles') if spec['type'] == 'sweep' else None
+    profile_names = sorted(profiles.keys()) if profiles else [None]
+    columns = names + (['PROFILE'] if profiles else [])
+
+    # skip parameter sets (and profiles) finished before a restart
+    sweep_path = os.path.join(job_path, 'sweep.csv')
+    finished = pd.read_csv(sweep_path) if spec['type'] == 'sweep' and os.path.exists(sweep_path) else None
+    done = set() if finished is None else set(tuple(row) for row in finished[columns].values.tolist())
+    bars = 0
+
+    for values in itertools.product(*[grid[name] for name in names]):
+        pending = [name for name in profile_names
+                   if tuple(values) + ((name,) if profiles else ()) not in done]
+        if len(pending) == 0:
+            continue
+        params = dict(spec.get('params', {}))
+        params.update(zip(names, values))
+
+        def new_tester(cost_profile):
+            return BackTester(data=data.copy(), commission=spec.get('commission', 2E-5),
+                              start=spec.get('start', '20160101'), end=spec.get('end', '20161001'),
+                              strategy_params=params, feature_cache=cache, execution=cost_profile)
+
+        results = []
+        if init is None:
+            # one strategy run, each cost profile only evaluates its orders again
+            back_tester = new_tester(default_profile)
+            bars += len(back_tester.trades)     # one entry per bar before run
+            back_tester.run_vector(strategy)
+            for name in pending:
+                back_tester.evaluate(make_profile(profiles[name]) if name is not None else None)
+                results.append((name, stats(back_tester), back_tester))
+        else:
+            # event-driven costs apply fill by fill, so each cost profile runs the strategy again
+            for name in pending:
+                back_tester = new_tester(make_profile(profiles[name]) if name is not None else default_profile)
+                bars += len(back_tester.trades)
+                back_tester.run_event(init, strategy)
+                results.append((name, stats(back_tester), back_tester))
+
+        for name, (sharpe, max_dd), back_tester in results:
+            if spec['type'] == 'sweep':
+                row = pd.DataFrame([list(values) + ([name] if profiles else []) + [sharpe, max_dd]],
+                                   columns=columns + ['SHARPE', 'MAX_DD'])
+                row.to_csv(sweep_path, mode='a', header=not os.path.exists(sweep_path), index=False)
+            else:
+                back_tester.curve.to_csv(os.path.join(job_path, 'curve.csv'))
+                back_tester.pnl.to_csv(os.path.join(job_path, 'pnl.csv'))
+                with open(os.path.join(job_path, 'result.json'), 'w') as f:
+                    json.dump({'sharpe': sharpe, 'max_dd': max_dd}, f, indent=2)
+        queue.update(job_id, bars=bars)
+
+
+def run_download(queue, job_id, spec, job_path):
+    """
+    download historical data with Loader
+    job spec keys: symbol, exch, start, end, sec_type, expiration, bar_size, item, port, output,
+    client_id (CLIENT_ID plus job index by default)
+    results: data.csv (or 'output' path)
+    :return: None
+    """
+    from loader import Loader, PORT
+
+    loader = Loader(symbol=spec['symbol'], exch=spec['exch'], start=spec['start'], end=spec['end'],
+                    sec_type=spec.get('sec_type', 'STK'), expiration=spec.get('expiration'),
+                    bar_size=spec.get('bar_size', '5 secs'), store=os.path.join(job_path, 'bars'),
+                    port=spec.get('port', PORT), client_id=queue.client_id(job_id))
+
+    # report progress while request() blocks
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(PROGRESS_INTERVAL):
+            queue.update(job_id, bars=loader.num_bars, requests=loader.num_requests)
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+    try:
+        loader.request(spec.get('item', 'TRADES'))
+    finally:
+        stop.set()
+        reporter.join()
+    queue.update(job_id, bars=loader.num_bars, requests=loader.num_requests)
+    loader.save(spec.get('output', os.path.join(job_path, 'data.csv')))
+
+
+def main(argv=None):
+    """
+    command line interface
+    submit: add jobs from JSON/YAML spec files, run: run queued jobs (resume unfinished ones), status: show jobs
+    :param argv: list of str, command line arguments (sys.argv[1:] if None)
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description='batch runner of back tests, sweeps and downloads')
+    parser.add_argument('--jobs', default=PATH_JOBS, help='folder path of job queue (default: $IBALGO_JOBS or ./jobs)')
+    commands = parser.add_subparsers(dest='command')
+    submit = commands.add_parser('submit', help='submit jobs from JSON/YAML spec files')
+    submit.add_argument('specs', nargs='+')
+    run = commands.add_parser('run', help='run queued jobs, resume jobs left running')
+    run.add_argument('--workers', type=int, default=1)
+    commands.add_parser('status', help='show status and throughput of jobs')
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.jobs)
+    if args.command == 'submit':
+        for file_path in args.specs:
+            for spec in load_spec(file_path):
+                print queue.submit(spec)
+    elif args.command == 'run':
+        queue.run(workers=args.workers)
+    else:
+        with pd.option_context('display.width', 200):
+            print queue.status()
+
+
+if __name__ == '__main__':
+    main()